@@ -1,4 +1,6 @@
 import os
+import json
+import zlib
 import uuid
 import datetime
 import threading
@@ -192,6 +194,27 @@ rooms = {}
 viewer_to_room = {}
 lock = threading.Lock()
 
+# --------------------
+# 壓縮傳輸格式（需客戶端協商）
+# --------------------
+# 客戶端在 join 時以 encodings 宣告可解的格式；目前只支援 'deflate'
+# （UTF-8 JSON 經 zlib 壓縮後以二進位 frame 送出）。未宣告的舊客戶端一律維持 JSON 文字。
+# 註：eventlet 的 WebSocket 已會與瀏覽器協商 permessage-deflate；此格式用於經過會剝除
+# 該擴充的代理時，以及讓 state_update 的大小不再依賴傳輸層設定。
+COMPACT_ENCODING = 'deflate'
+COMPACT_THRESHOLD_BYTES = 1024
+
+
+def encode_compact_state(state):
+    """將完整狀態壓成 deflate 二進位；未達門檻或壓縮後沒有變小則回傳 None。"""
+    raw = json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if len(raw) < COMPACT_THRESHOLD_BYTES:
+        return None
+    packed = zlib.compress(raw, 6)
+    if len(packed) >= len(raw):
+        return None
+    return packed
+
 # --------------------
 # 網頁路由
 # --------------------
@@ -254,6 +277,7 @@ def new_room():
             'last_active': datetime.datetime.now(),
             'directors': set(),
             'viewers': set(),
+            'compact': set(),
             'viewer_id': viewer_id
         }
         viewer_to_room[viewer_id] = director_id
@@ -311,6 +335,27 @@ def broadcast_connection_counts(room_id):
     if payload is not None:
         socketio.emit('connection_update', payload, to=room_id)
 
+def emit_state_update(room_id, state, to=None):
+    """state_update 的統一出口：已協商 deflate 的連線收 state_update_compact（二進位），
+    其餘連線照舊收 JSON 的 state_update。to 為單一 sid 時只送給該連線，否則廣播整個房間。"""
+    with lock:
+        compact_sids = set(rooms.get(room_id, {}).get('compact', set()))
+    # 只有在確實有已協商的收件者時才壓縮，未協商的連線不需負擔 dumps + compress。
+    if to is not None:
+        packed = encode_compact_state(state) if to in compact_sids else None
+        if packed is not None:
+            socketio.emit('state_update_compact', packed, to=to)
+        else:
+            socketio.emit('state_update', state, to=to)
+        return
+    packed = encode_compact_state(state) if compact_sids else None
+    if packed is not None:
+        compact_sids = list(compact_sids)
+        socketio.emit('state_update_compact', packed, to=compact_sids)
+        socketio.emit('state_update', state, to=room_id, skip_sid=compact_sids)
+    else:
+        socketio.emit('state_update', state, to=room_id)
+
 @socketio.on('join')
 def on_join(data):
     requested_room = data.get('room')
@@ -332,6 +377,10 @@ def on_join(data):
             room_data = rooms[room_id]
             room_data.setdefault('directors', set()).discard(sid)
             room_data.setdefault('viewers', set()).discard(sid)
+            room_data.setdefault('compact', set()).discard(sid)
+            encodings = data.get('encodings')
+            if isinstance(encodings, list) and COMPACT_ENCODING in encodings:
+                room_data['compact'].add(sid)
             if role == 'viewer':
                 room_data['viewers'].add(sid)
             else:
@@ -345,7 +394,7 @@ def on_join(data):
             with lock:
                 viewer_id = rooms.get(room_id, {}).get('viewer_id')
             state['viewer_id'] = viewer_id
-            emit('state_update', state)
+            emit_state_update(room_id, state, to=sid)
             update_last_active(room_id)
     else:
         print(f"客戶端 {request.sid} 嘗試加入不存在的房間 {requested_room}（role={role}）")
@@ -359,7 +408,7 @@ def handle_script_update(data):
     if manager:
         manager.update_script(data.get('raw_text', ''))
         state = manager.get_full_state()
-        emit('state_update', state, to=room_id)
+        emit_state_update(room_id, state)
         update_last_active(room_id)
 
 @socketio.on('update_director_settings')
@@ -419,12 +468,12 @@ def handle_script_patch(data):
             with lock:
                 viewer_id = rooms.get(room_id, {}).get('viewer_id')
             state['viewer_id'] = viewer_id
-            emit('state_update', state, to=request.sid)
+            emit_state_update(room_id, state, to=request.sid)
             update_last_active(room_id)
         else:
             # If patch fails, force a state update to re-sync all clients
             state = manager.get_full_state()
-            emit('state_update', state, to=room_id)
+            emit_state_update(room_id, state)
 
 @socketio.on('update_quick_inputs')
 def handle_quick_inputs_update(data):
@@ -435,7 +484,7 @@ def handle_quick_inputs_update(data):
     if manager:
         manager.update_quick_inputs(data.get('inputs', {}))
         state = manager.get_full_state()
-        emit('state_update', state, to=room_id)
+        emit_state_update(room_id, state)
         update_last_active(room_id)
 
 @socketio.on('cursor_sync')
@@ -599,6 +648,7 @@ def handle_disconnect():
                     data['directors'].remove(sid)
                 if is_viewer:
                     data['viewers'].remove(sid)
+                data.get('compact', set()).discard(sid)
                 room_to_update = room_id
                 
                 # Check and release speech lock